@@ -5,13 +5,40 @@ Library to deal with JC024_V02 SunStudio LCD and similar, from Python (via seria
     https://github.com/fbcosentino/python-jc024-lcd
 """
 
+import array
+import asyncio
+import contextlib
+import sys
 import serial
-import time
 
+try:
+    # only available on POSIX systems, used for the low latency mode
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None
+    termios = None
 
+try:
+    # optional, only needed by encode_rgb565()
+    import numpy
+except ImportError:
+    numpy = None
 
-class SunLCD:
-    """This class represents one LCD object. Create one instance per display."""
+try:
+    # optional, only needed by AsyncSunLCD
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+
+
+class _SunLCDBase:
+    """
+    Called internally. Everything shared by SunLCD and AsyncSunLCD: constants,
+    image and font lists, and building the command strings. Nothing here
+    talks to the serial port.
+    """
 
     #Vertical orientation
     VERTICAL = 0
@@ -35,26 +62,377 @@ class SunLCD:
     COLOR_LIGHT_RED = 14
     COLOR_WHITE = 15
 
-    def __init__(self, port = '/dev/ttyUSB0', width=240, height=320):
-        """Creates one instance for one display.
-        
-        :param port: Serial port (default '/dev/ttyUSB0')
+    #Maximum length of one command line sent to the LCD, counting the
+    #\r\n at the end (the old flush every 16 chars produced commands of
+    #about this size without issues).
+    #The firmware has no way to report its buffer size, so if yours is
+    #known to be different, set instance.MAX_CMD_BYTES after creating it.
+    MAX_CMD_BYTES = 480
+    #How many MAX_CMD_BYTES commands may be waiting for an answer at once.
+    #1 waits for each answer before the next command is written. 2 lets the
+    #lcd render one command while the next one is queued, but only if its
+    #RX buffer can hold both (not verified for the stock firmware).
+    PIPELINE_DEPTH = 1
+
+    @property
+    def max_pending_bytes(self):
+        """
+        Maximum amount of bytes sent with send_serial_async() (or queued by
+        batch()) still waiting for an answer. Calculated from MAX_CMD_BYTES
+        and PIPELINE_DEPTH every time, so changing them on the instance works.
         """
-        self.ser = serial.Serial(port, 115200, timeout=1)
+        return self.PIPELINE_DEPTH*self.MAX_CMD_BYTES
+        
+    def _init_state(self, width, height):
+        """Called internally. Initializes everything not related to the serial port."""
         self.ok = False
-        self.response_body = ""
-        self._buf = ""
+        # last answer from the lcd, as bytes
+        self.response_body = b""
         self.cursor = [0,0]
         self.img_list = []
         self.img_offset = 2097152 
         self.font_list = []
+        self.font_templates = []
         
         # these are used to calculate font line wrap
         self.current_orientation = self.VERTICAL
         self.standard_width = width
         self.standard_height = height
+        
+
+
+    # ========================================================================
+    # COMMAND BUILDING METHODS
+    # ========================================================================
+    
+    def _on_cmd(self, on_off):
+        """Called internally. Builds the command used by On()."""
+        if (on_off is False) or (on_off == 0):
+            return "LCDON(0)"
+        return "LCDON(1)"
+        
+    def _raw_image_cmd(self, address, position, size, transparent):
+        """Called internally. Builds the command used by RawImage()."""
+        return "FSIMG(%s,%s,%s,%s,%s,%s)" % (address, position[0], position[1], size[0], size[1], transparent)
+        
+    def _show_image_cmd(self, image_id, position, transparent):
+        """
+        Called internally. Builds the command used by ShowImage().
+        
+        :returns: The command, or None if the image does not exist.
+        """
+        if image_id > (len(self.img_list)-1):
+            return None
+        img_info = self.img_list[image_id]
+        return self._raw_image_cmd(img_info[0], position, img_info[1], transparent)
+        
+    def _orientation_cmd(self, orientation):
+        """
+        Called internally. Builds the command used by Orientation(),
+        and updates the orientation used for font line wrap.
+        
+        :returns: The command, or None if the orientation is not valid.
+        """
+        if (orientation == 0):
+            self.current_orientation = orientation
+            return "DIR(0)"
+        elif (orientation == 1):
+            self.current_orientation = orientation
+            return "DIR(1)"
+        return None
+        
+    def _brightness_cmd(self, level):
+        """
+        Called internally. Builds the command used by Brightness().
+        
+        :returns: The command, or None if the level is not a number.
+        """
+        try:
+            bl_val = int( (1.0 - float(level))*255 ) 
+        except:
+            return None
+        if bl_val < 0:
+            bl_val = 0
+        if bl_val > 255:
+            bl_val = 255
+        return "BL(%d)" % bl_val
+        
+    def _point_cmd(self, location, color):
+        """Called internally. Builds the command used by Point()."""
+        return "PS(%s,%s,%s)" % (location[0], location[1], color)
+        
+    def _line_cmd(self, origin, destination, color):
+        """Called internally. Builds the command used by Line()."""
+        return "PL(%s,%s,%s,%s,%s)" % (origin[0], origin[1], destination[0], destination[1], color)
+        
+    def _box_cmd(self, name, top_left, bottom_right, color):
+        """Called internally. Builds the BOX/BOXF commands used by HollowBox() and FilledBox()."""
+        return "%s(%s,%s,%s,%s,%s)" % (name, top_left[0], top_left[1], bottom_right[0], bottom_right[1], color)
+        
+    def _circle_cmd(self, name, center, radius, color):
+        """Called internally. Builds the CIR/CIRF commands used by HollowCircle() and FilledCircle()."""
+        return "%s(%s,%s,%s,%s)" % (name, center[0], center[1], radius, color)
+        
+    def _text_cmd(self, name, location, text, color):
+        """Called internally. Builds the DCVxx commands used by TextSmall(), TextMedium() and TextLarge()."""
+        return "%s(%s,%s,'%s',%s)" % (name, location[0], location[1], text, color)
+        
+    def _encode(self, cmd):
+        """
+        Called internally. Converts a command to the bytes sent to the LCD.
+        
+        :param cmd: The command (str or bytes)
+        :returns: The command as bytes, or None if it is not ASCII (the
+            firmware only handles ASCII text).
+        """
+        if isinstance(cmd, (bytes, bytearray)):
+            return cmd
+        try:
+            return cmd.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+        
+    def _to_position(self, position):
+        """
+        Called internally. Validates a position given by the user.
+        
+        :returns: A tuple (X,Y), or None if position is not a pair.
+        """
+        try:
+            x, y = position
+        except (TypeError, ValueError):
+            return None
+        return (x, y)
+    
+    
+    
+    @staticmethod
+    def encode_rgb565(rgb_array):
+        """
+        Converts an RGB image into the RGB565 format used by the LCD memory
+        (2 bytes per pixel, high byte first). Needs numpy.
+        
+        :param rgb_array: An array (or nested lists) of shape (H,W,3) with 8-bit R,G,B values
+        :returns: The image data as bytes, H*W*2 long.
+        """
+        if numpy is None:
+            raise ImportError("encode_rgb565 needs the numpy package")
+        rgb = numpy.asarray(rgb_array, dtype=numpy.uint8)
+        r = (rgb[:,:,0] >> 3).astype(numpy.uint16)
+        g = (rgb[:,:,1] >> 2).astype(numpy.uint16)
+        b = (rgb[:,:,2] >> 3).astype(numpy.uint16)
+        return ((r << 11) | (g << 5) | b).astype('>u2').tobytes()
+    
+    
+    
+    
+    
+    # ========================================================================
+    # OBJECT-LEVEL METHODS
+    # ========================================================================
+    
+    def MoveTo(self, position):
+        """
+        Sets the location of the internal cursor, without drawing anything.
+        
+        :param position: A tuple (X,Y)
+        :returns: True on success, False otherwise.
+        """
+        position = self._to_position(position)
+        if position is None:
+            return False
+        # do not assign directly to avoid changing type
+        # or replacing the list variable with a pointer
+        self.cursor[0] = position[0]
+        self.cursor[1] = position[1]
+        return True
+    
+    
+    def ListImage(self, size):
+        """
+        Adds image information into a list
+        
+        :param size: A tuple (W,H)
+        :returns: The image ID
+        """
+        byte_len = size[0]*size[1]*2
+        self.img_list.append([self.img_offset,size])
+        self.img_offset += byte_len
+        return len(self.img_list)-1
+        
+        
+    # 
+    def ListFont(self, char_size, char_list = " !\"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\]^_`abcdefghijklmnopqrstuvwxyz{|}~"):
+        """
+        Adds information over a list of monospaced character images.
+        They must be present in the flash memory sequentially in the same order.
+        
+        :param char_size: A tuple (W,H)
+        :param char_list: A string containing the chars in the same order as 
+            they appear in the map. Defaults to ASCII char range 0x20 - 0x7E
+        :returns: Font ID
+        """
+        this_font = {}
+        this_templates = {}
+        # all chars have the same size, so the images are laid out
+        # at regular intervals starting at the current offset
+        byte_len = char_size[0]*char_size[1]*2
+        start = self.img_offset
+        base_id = len(self.img_list)
+        cl_len = len(char_list)
+        self.img_list.extend([[start + i*byte_len, char_size] for i in range(cl_len)])
+        self.img_offset += cl_len*byte_len
+        # create the font map
+        for i, c in enumerate(char_list):
+            this_font[c] = base_id + i
+            # FSIMG(addr,x,y,w,h,mode) with only x, y and mode left to fill
+            this_templates[c] = b"FSIMG(%d,%%d,%%d,%d,%d,%%d);" % (start + i*byte_len, char_size[0], char_size[1])
+        # add the font to the font list
+        self.font_list.append(this_font)
+        self.font_templates.append(this_templates)
+        return len(self.font_list)-1
+        
+    def _text_batches(self, font_id, position, text, transparent):
+        """
+        Called internally. Builds the FSIMG commands used by TextFont().
+        
+        :returns: A list of commands, each fitting in MAX_CMD_BYTES with
+            the line ending,
+            or None if the font does not exist.
+        """
+        if font_id > (len(self.font_list)-1):
+            return None
+        this_font = self.font_list[font_id]
+        this_templates = self.font_templates[font_id]
+        # this_font[ 'char' ] = Image ID
+        # this_templates[ 'char' ] = FSIMG command template
+        # self.img_list[ Image ID ][1] = (W,H)
+        
+        if self.current_orientation == self.HORIZONTAL:
+            lcd_w = self.standard_height
+            lcd_h = self.standard_width
+        else:
+            lcd_w = self.standard_width
+            lcd_h = self.standard_height
+        
+        
+        # any iterable of chars is accepted, as with the old per char loop,
+        # and items that are not chars (e.g. the ints of a bytes) are ignored
+        if not isinstance(text, str):
+            text = "".join(c for c in text if isinstance(c, str))
+        # drop the chars not found in the font all at once, so the loop
+        # below only sees printable chars
+        missing = set(text).difference(this_font)
+        if len(missing) > 0:
+            text = text.translate(dict.fromkeys(map(ord, missing)))
+        if len(text) == 0:
+            return []
+        
+        # fonts are monospaced, so any char gives the size
+        char_w, char_h = self.img_list[this_font[text[0]]][1]
+        wrap_x = lcd_w - char_w
+        wrap_y = lcd_h - char_h
+        
+        x = position[0]
+        y = position[1]
+        
+        # locals are faster than attribute lookups inside the loop
+        # leave room for the \r\n added when the command is sent
+        max_bytes = self.MAX_CMD_BYTES - 2
+        batches = []
+        add_batch = batches.append
+        
+        # we have to flush before the string grows past MAX_CMD_BYTES
+        # to avoid buffer overflow in the lcd
+        send_str = bytearray()
+        for template in [this_templates[c] for c in text]:
+            # FSIMG(addr,x,y,w,h,mode)
+            # each one is sent in full: the firmware has no command to repeat
+            # an image and needs all arguments, so runs of the same char
+            # (e.g. spaces) cannot be shortened
+            char_cmd = template % (x, y, transparent)
+
+            # if this char would overflow the lcd buffer, send what we
+            # have so far and start a new buffer
+            if len(send_str) + len(char_cmd) > max_bytes:
+                add_batch(send_str)
+                send_str = bytearray()
+            send_str.extend(char_cmd)
+
+            # Moves the cursor
+            x += char_w
+            # line wrap?
+            if x >= wrap_x:
+                x = 0
+                y += char_h
+                # screen wrap?
+                if y >= wrap_y:
+                    y = 0
+
+        if len(send_str) > 0:
+            add_batch(send_str)
+        return batches
+        
+        # chars in the first line and in the following ones (starting at x = 0),
+        # and the same for lines in the first screen and the following ones
+        # -(-a // b) is the rounded up a/b, at least one char always fits
+        first_cols = max(1, -((x0 - wrap_x) // char_w))
+        cols = max(1, -(-wrap_x // char_w))
+        first_rows = max(1, -((y0 - wrap_y) // char_h))
+        rows = max(1, -(-wrap_y // char_h))
+        
+        positions = []
+        for i in range(count):
+            if i < first_cols:
+                line = 0
+                x = x0 + i*char_w
+            else:
+                line, col = divmod(i - first_cols, cols)
+                line += 1
+                x = col*char_w
+            if line < first_rows:
+                y = y0 + line*char_h
+            else:
+                y = ((line - first_rows) % rows)*char_h
+            positions.append((x, y))
+        return positions
+
+
+
+class SunLCD(_SunLCDBase):
+    """
+    This class represents one LCD object. Create one instance per display.
+    
+    After each command, instance.ok is True if the LCD answered OK, and
+    instance.response_body holds the last answer line as bytes (e.g. b'OK').
+    """
+
+    def __init__(self, port = '/dev/ttyUSB0', width=240, height=320, baudrate=115200, timeout=1):
+        """Creates one instance for one display.
+        
+        :param port: Serial port (default '/dev/ttyUSB0')
+        :param baudrate: Serial baudrate (default 115200). Must match the one
+            stored in the display, see Baudrate().
+        :param timeout: Maximum time in seconds to wait for each answer (default 1).
+            Answers are read as soon as they arrive, so this only matters when
+            the display does not answer.
+        """
+        self.ser = serial.Serial(port, baudrate, timeout=timeout)
+        # larger driver buffers let the OS coalesce writes (Windows only)
+        if hasattr(self.ser, 'set_buffer_size'):
+            self.ser.set_buffer_size(rx_size=65536, tx_size=65536)
+        # USB serial adapters otherwise hold short answers for up to 16ms
+        self.set_low_latency(True)
+        self._init_state(width, height)
+        self._buf = b""
+        self._pending_acks = 0
+        self._pending_bytes = 0
+        self._write_buffer = None
 
-        self.ser.write("\r\n") # flush in case some garbage was already sent
+        self.ser.write(b"\r\n") # flush in case some garbage was already sent
+        # and drop whatever the lcd answered to that
+        self.ser.flush()
+        self._discard_input()
         if self.Reset():
             self.Background(self.COLOR_BLACK)
         
@@ -66,24 +444,34 @@ class SunLCD:
             
     def ReadBack(self):
         """
-        Called internally. Reads the response from the LCD and acts accordingly.
+        Reads any response already received from the LCD, without waiting,
+        and acts accordingly. Not needed by the other methods, which wait
+        for their own answers, but useful to poll for pending data.
+        Answers to commands sent with send_serial_async() or batch() are
+        counted as received, so they are not waited for again.
         
         :returns: True if response received, None otherwise.
         """
-        responses = []
-        while self.ser.inWaiting() > 0:
-            c = self.ser.read(1)
-            if (ord(c) == 10):
-                responses.append(self._buf.strip())
-                self._buf = ""
-            else:
-                self._buf += c
+        # read everything available at once and split it into lines,
+        # keeping any incomplete line in the buffer for the next call
+        waiting = self.ser.in_waiting
+        if waiting > 0:
+            self._buf += self.ser.read(waiting)
+        lines = self._buf.split(b"\n")
+        self._buf = lines.pop()
+        responses = [line.strip() for line in lines]
                 
         if len(responses) == 0:
             return None
+        
+        # the first lines are the answers _drain_acks() is waiting for
+        reaped = min(len(responses), self._pending_acks)
+        self._pending_acks -= reaped
+        if self._pending_acks == 0:
+            self._pending_bytes = 0
             
         for response in responses:
-            if response == 'OK':
+            if response == b'OK':
                 self.ok = True
             self.response_body = response
                 
@@ -93,20 +481,174 @@ class SunLCD:
         """
         Sends a command over the serial port, and waits for any answer.
         
-        :param cmd: The command to be sent, without newlines.
+        Inside a batch() block the command is only queued and True is returned.
+        The answer is stored (as bytes) in instance.response_body, and
+        instance.ok tells whether it was OK.
+        
+        :param cmd: The command to be sent (str or bytes), without newlines.
+        :returns: True on response, False on timeout or if cmd is not ASCII.
+        """
+        if self._write_buffer is not None:
+            return self.send_serial_async(cmd)
+        cmd = self._encode(cmd)
+        if cmd is None:
+            return False
+        # answers still pending would be mistaken for the answer to this one
+        if self._pending_acks > 0:
+            self._drain_acks()
+        self._discard_stale()
+        self.ser.write(cmd+b"\r\n")
+        return self._read_response()
+        
+    def send_serial_async(self, cmd):
+        """
+        Sends a command over the serial port without waiting for the answer.
+        Answers are collected later by _drain_acks(), which is also called
+        here if too many bytes are still waiting for an answer.
+        
+        :param cmd: The command to be sent (str or bytes), without newlines.
+        :returns: True on success, False if an answer collected here timed out
+            or if cmd is not ASCII.
+        """
+        cmd = self._encode(cmd)
+        if cmd is None:
+            return False
+        data = cmd+b"\r\n"
+        self._discard_stale()
+        res = True
+        if (self._pending_acks > 0) and (self._pending_bytes + len(data) > self.max_pending_bytes):
+            res = self._drain_acks()
+        if self._write_buffer is not None:
+            self._write_buffer.append(data)
+        else:
+            self.ser.write(data)
+        self._pending_acks += 1
+        self._pending_bytes += len(data)
+        return res
+        
+    def _drain_acks(self):
+        """
+        Called internally. Waits for the answers to all commands sent
+        with send_serial_async().
+        
+        :returns: True if all answers were received, False on timeout.
+        """
+        # commands queued by batch() must reach the lcd before it can answer
+        if self._write_buffer:
+            self.ser.write(b"".join(self._write_buffer))
+            self.ser.flush()
+            del self._write_buffer[:]
+        res = True
+        all_ok = True
+        while self._pending_acks > 0:
+            self._pending_acks -= 1
+            if self._read_response() is False:
+                res = False
+                break
+            all_ok = all_ok and self.ok
+        self.ok = res and all_ok
+        self._pending_acks = 0
+        self._pending_bytes = 0
+        return res
+        
+    def _read_response(self):
+        """
+        Called internally. Waits for one answer line from the LCD.
+        
         :returns: True on response, False on timeout.
         """
         self.ok = False
-        self.response_body = ""
-        self.ser.write(cmd+"\r\n")
-        i = 10
-        while i > 0:
-            time.sleep(0.1)
-            i -= 1
-            res = self.ReadBack()
-            if res is not None:
+        self.response_body = b""
+        # blocks until a full line arrives or the serial timeout expires,
+        # starting from any partial line left behind by ReadBack()
+        line = (self._buf + self.ser.readline()).strip()
+        self._buf = b""
+        if len(line) == 0:
+            # an answer arriving late would be taken for the next one
+            self._discard_input()
+            return False
+        self.ok = (line == b'OK')
+        self.response_body = line
+        return True
+        
+    def _discard_stale(self):
+        """
+        Called internally before sending a command. If no answer is expected,
+        anything already received (late answers, or extra lines) is stale
+        and would be mistaken for the answer to the next command.
+        """
+        if self._pending_acks == 0 and (len(self._buf) > 0 or self.ser.in_waiting > 0):
+            self._discard_input()
+        
+    def _discard_input(self):
+        """Called internally. Throws away anything received and not read yet."""
+        self.ser.reset_input_buffer()
+        self._buf = b""
+        
+    def set_low_latency(self, enabled):
+        """
+        Enables or disables the low latency mode of the serial port (Linux only).
+        With it, USB serial adapters such as FTDI deliver the answers right
+        away instead of waiting for their latency timer (16ms by default).
+        
+        :param enabled: True to enable, False to disable.
+        :returns: True on success, False if not supported by the port.
+        """
+        # pyserial 3.5+
+        if hasattr(self.ser, 'set_low_latency_mode'):
+            try:
+                self.ser.set_low_latency_mode(enabled)
                 return True
-        return False
+            except (IOError, OSError, ValueError, NotImplementedError):
+                return False
+        # older pyserial: same ioctl recipe pyserial uses
+        if (fcntl is None) or (not sys.platform.startswith('linux')):
+            return False
+        try:
+            buf = array.array('i', [0] * 32)
+            fcntl.ioctl(self.ser.fileno(), getattr(termios, 'TIOCGSERIAL', 0x541E), buf)
+            if enabled:
+                buf[4] |= 0x2000 # ASYNC_LOW_LATENCY
+            else:
+                buf[4] &= ~0x2000
+            fcntl.ioctl(self.ser.fileno(), getattr(termios, 'TIOCSSERIAL', 0x541F), buf)
+            return True
+        except (IOError, OSError, AttributeError, ValueError):
+            return False
+        
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Groups several commands into as few serial writes as possible.
+        Commands called inside the block are queued and return True right
+        away, and the answers are read when the block ends. After the block
+        instance.ok is True only if every command was answered with OK.
+        If the block raises, the commands still queued are not sent.
+        
+        Usage::
+        
+            with lcd.batch():
+                lcd.Point((10,10))
+                lcd.Line((0,0), (100,100))
+        """
+        if self._write_buffer is not None:
+            # already inside a batch
+            yield self
+            return
+        self._write_buffer = []
+        try:
+            yield self
+        except BaseException:
+            # drop the queued commands instead of sending them, answers to
+            # anything already written are discarded before the next command
+            self._write_buffer = None
+            self._pending_acks = 0
+            self._pending_bytes = 0
+            raise
+        try:
+            self._drain_acks()
+        finally:
+            self._write_buffer = None
         
         
         
@@ -129,11 +671,14 @@ class SunLCD:
         
     def Baudrate(self, baudrate):
         """Changes the baudrate. BE CAREFUL: THIS IS PERMANENT IN FLASH!
+        A higher baudrate (e.g. 460800) makes long commands such as TextFont()
+        faster. This only has to be done once, afterwards create the instance
+        with SunLCD(port, baudrate=460800).
         
         :param baudrate: The new baudrate. Both the display and this object will be modified.
         :returns: True on success, False otherwise. But always fails...
         """
-        res = self.send_serial("BPS("+str(baudrate)+")")
+        res = self.send_serial("BPS(%s)" % (baudrate,))
         self.ser.close()
         self.ser.baudrate = baudrate
         self.ser.open()
@@ -146,7 +691,7 @@ class SunLCD:
         :param color: Screen color (default black).
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("CLR("+str(color)+")")
+        res = self.send_serial("CLR(%s)" % (color,))
         return res
     
         
@@ -156,10 +701,7 @@ class SunLCD:
         :param on: If False or 0, will turn LCD OFF. Anything else will turn ON.
         :returns: True on success, False otherwise.
         """
-        if (on_off is False) or (on_off == 0):
-            res = self.send_serial("LCDON(0)")
-        else:
-            res = self.send_serial("LCDON(1)")
+        res = self.send_serial(self._on_cmd(on_off))
         return res
         
     def RawImage(self, address, position, size, transparent = 0):
@@ -172,7 +714,7 @@ class SunLCD:
         :param transparent: 0 - not transparent. 1 - transparent (transparent color is white)
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("FSIMG("+str(address)+","+str(position[0])+","+str(position[1])+","+str(size[0])+","+str(size[1])+","+str(transparent)+")")
+        res = self.send_serial(self._raw_image_cmd(address, position, size, transparent))
         return res
     
     
@@ -187,14 +729,10 @@ class SunLCD:
         :param orientation: 1 is horizontal, 0 is vertical. 
         :returns: True on success, False otherwise.
         """
-        if (orientation == 0):
-            self.current_orientation = orientation
-            res = self.send_serial("DIR(0)")
-        elif (orientation == 1):
-            self.current_orientation = orientation
-            res = self.send_serial("DIR(1)")
-        else:
-            res = False
+        cmd = self._orientation_cmd(orientation)
+        if cmd is None:
+            return False
+        res = self.send_serial(cmd)
         return res
     
     
@@ -204,15 +742,10 @@ class SunLCD:
         :param level: Intensity in the range 0.0 - 1.0
         :returns: True on success, False otherwise.
         """
-        try:
-            bl_val = int( (1.0 - float(level))*255 ) 
-        except:
+        cmd = self._brightness_cmd(level)
+        if cmd is None:
             return False
-        if bl_val < 0:
-            bl_val = 0
-        if bl_val > 255:
-            bl_val = 255
-        res = self.send_serial("BL("+str(bl_val)+")")
+        res = self.send_serial(cmd)
         return res
     
     def Point(self, location, color = 15):
@@ -223,7 +756,7 @@ class SunLCD:
         :param color: Point color (default white).
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("PS("+str(location[0])+","+str(location[1])+","+str(color)+")")
+        res = self.send_serial(self._point_cmd(location, color))
         return res
 
     def Line(self, origin, destination, color = 15):
@@ -235,7 +768,7 @@ class SunLCD:
         :param color: Point color (default white).
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("PL("+ str(origin[0])+","+str(origin[1]) + "," + str(destination[0])+","+str(destination[1]) + ","+str(color)+")")
+        res = self.send_serial(self._line_cmd(origin, destination, color))
         return res
     
     def HollowBox(self, top_left, bottom_right, color = 15):
@@ -247,7 +780,7 @@ class SunLCD:
         :param color: Point color (default white).
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("BOX("+ str(top_left[0])+","+str(top_left[1]) + "," + str(bottom_right[0])+","+str(bottom_right[1]) + ","+str(color)+")")
+        res = self.send_serial(self._box_cmd("BOX", top_left, bottom_right, color))
         return res
     
     def FilledBox(self, top_left, bottom_right, color = 15):
@@ -259,7 +792,7 @@ class SunLCD:
         :param color: Point color (default white).
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("BOXF("+ str(top_left[0])+","+str(top_left[1]) + "," + str(bottom_right[0])+","+str(bottom_right[1]) + ","+str(color)+")")
+        res = self.send_serial(self._box_cmd("BOXF", top_left, bottom_right, color))
         return res
     
     def HollowCircle(self, center, radius, color = 15):
@@ -271,7 +804,7 @@ class SunLCD:
         :param color: Point color (default white).
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("CIR("+ str(center[0])+","+str(center[1]) + "," + str(radius) + ","+str(color)+")")
+        res = self.send_serial(self._circle_cmd("CIR", center, radius, color))
         return res
     
     def FilledCircle(self, center, radius, color = 15):
@@ -283,7 +816,7 @@ class SunLCD:
         :param color: Point color (default white).
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("CIRF("+ str(center[0])+","+str(center[1]) + "," + str(radius) + ","+str(color)+")")
+        res = self.send_serial(self._circle_cmd("CIRF", center, radius, color))
         return res
     
     def Background(self, color):
@@ -292,7 +825,7 @@ class SunLCD:
         :param color: Color number (you can use one of the color names instance.COLOR_xxxx)
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("SBC("+str(color)+")")
+        res = self.send_serial("SBC(%s)" % (color,))
         return res
     
     def TextSmall(self, location, text, color = 15):
@@ -304,7 +837,7 @@ class SunLCD:
         :param color: Text color (default white). Current background color will be used.
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("DCV16("+str(location[0])+","+str(location[1])+",'"+str(text)+"',"+str(color)+")")
+        res = self.send_serial(self._text_cmd("DCV16", location, text, color))
         return res
     
     def TextMedium(self, location, text, color = 15):
@@ -316,7 +849,7 @@ class SunLCD:
         :param color: Text color (default white). Current background color will be used.
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("DCV24("+str(location[0])+","+str(location[1])+",'"+str(text)+"',"+str(color)+")")
+        res = self.send_serial(self._text_cmd("DCV24", location, text, color))
         return res
     
     def TextLarge(self, location, text, color = 15):
@@ -328,7 +861,7 @@ class SunLCD:
         :param color: Text color (default white). Current background color will be used.
         :returns: True on success, False otherwise.
         """
-        res = self.send_serial("DCV32("+str(location[0])+","+str(location[1])+",'"+str(text)+"',"+str(color)+")")
+        res = self.send_serial(self._text_cmd("DCV32", location, text, color))
         return res
 
     
@@ -339,75 +872,407 @@ class SunLCD:
     # ========================================================================
     # OBJECT-LEVEL METHODS
     # ========================================================================
-    
-    def MoveTo(self, position):
+            
+    def LineTo(self, position, color = 15):
         """
-        Sets the location of the internal cursor, without drawing anything.
+        Draws a line from the current internal cursor to the position specified,
+        and moves the cursor to that position.
         
         :param position: A tuple (X,Y)
+        :param color: Line color (default white).
         :returns: True on success, False otherwise.
         """
-        if (isinstance(position, tuple) or isinstance(position, list)) and (len(position) == 2):
-            # do not assign directly to avoid changing type
-            # or replacing the list variable with a pointer
-            self.cursor[0] = position[0]
-            self.cursor[1] = position[1]
-            return True
-        else:
+        position = self._to_position(position)
+        if position is None:
             return False
-            
-    def LineTo(self, position, color = 15):
+        if self.Line(self.cursor, position, color) is False:
+            return False
+        return self.MoveTo(position)
+                
+                
+    def ShowImage(self, image_id, position, transparent=0):
         """
-        Draws a line from the current internal cursor to the position specified,
-        and moves the cursor to that position.
+        Shows an image from te listed images (ListImage())
         
+        :param image_id: The ID returned by ListImage()
         :param position: A tuple (X,Y)
-        :param color: Line color (default white).
         :returns: True on success, False otherwise.
         """
-        if (isinstance(position, tuple) or isinstance(position, list)) and (len(position) == 2):
-            if self.Line(self.cursor, position, color) is False:
+        cmd = self._show_image_cmd(image_id, position, transparent)
+        if cmd is None:
+            return False
+        return self.send_serial(cmd)
+        
+    def TextFont(self, font_id, position, text, transparent=0):
+        """
+        Prints text using image fonts.
+        
+        :param font_id: The font ID given by ListFont
+        :param position: A tuple (X,Y)
+        :param text: The text to print. If a character is not
+            found in the font, it is ignored.
+        :param transparent: If 1, text will be rendered transparent.
+        :returns: True on success, False otherwise.
+        """
+        batches = self._text_batches(font_id, position, text, transparent)
+        if batches is None:
+            return False
+        
+        send = self.send_serial_async
+        for send_str in batches:
+            res = send(send_str)
+            if res is False:
                 return False
-            return self.MoveTo(position)
+        # inside batch() the answers are read when the block ends
+        if self._write_buffer is not None:
+            return True
+        # send_serial_async() only waits when max_pending_bytes are in
+        # flight, the remaining answers are read here at the end
+        return self._drain_acks()
+        
+
+
+
+class AsyncSunLCD(_SunLCDBase):
+    """
+    asyncio version of SunLCD, to drive several displays (or other I/O)
+    from one event loop. Needs the pyserial-asyncio package.
     
+    Create instances with ``lcd = await AsyncSunLCD.open(port)``. Methods
+    talking to the LCD are coroutines (``await lcd.Line((0,0), (10,10))``),
+    the others (MoveTo, ListImage, ListFont) are the same as in SunLCD.
+    instance.ok and instance.response_body (bytes) work as in SunLCD.
+    Call ``await lcd.close()`` when done.
+    """
+
+    def __init__(self, reader, writer, port, width=240, height=320, timeout=1):
+        """Called internally, use AsyncSunLCD.open() instead."""
+        self.reader = reader
+        self.writer = writer
+        self.port = port
+        self.timeout = timeout
+        # keeps each command paired with its answer when several
+        # tasks use the same display
+        self._lock = asyncio.Lock()
+        # answer lines, filled by _read_lines() running as a task
+        self._lines = asyncio.Queue()
+        self._reader_task = None
+        self._init_state(width, height)
+
+    @classmethod
+    async def open(cls, port = '/dev/ttyUSB0', width=240, height=320, baudrate=115200, timeout=1):
+        """Opens the serial port and creates one instance for one display.
+        
+        :param port: Serial port (default '/dev/ttyUSB0')
+        :param baudrate: Serial baudrate (default 115200), see SunLCD().
+        :param timeout: Maximum time in seconds to wait for each answer (default 1).
+        :returns: The new AsyncSunLCD instance.
+        """
+        if serial_asyncio is None:
+            raise ImportError("AsyncSunLCD needs the pyserial-asyncio package")
+        reader, writer = await serial_asyncio.open_serial_connection(url=port, baudrate=baudrate)
+        lcd = cls(reader, writer, port, width, height, timeout)
+        lcd._start_reading()
+        
+        writer.write(b"\r\n") # flush in case some garbage was already sent
+        # any answer to the flush is discarded when Reset() is sent
+        if await lcd.Reset():
+            await lcd.Background(lcd.COLOR_BLACK)
+        return lcd
+        
+    async def close(self):
+        """Closes the serial port."""
+        async with self._lock:
+            self._reader_task.cancel()
+            self.writer.close()
+            await self.writer.wait_closed()
+        
+        
+        
+    # ========================================================================
+    # SERIAL PROCESSING METHODS
+    # ========================================================================
     
-    def ListImage(self, size):
+    async def send_serial(self, cmd):
         """
-        Adds image information into a list
+        Sends a command over the serial port, and waits for any answer.
+        
+        :param cmd: The command to be sent (str or bytes), without newlines.
+        :returns: True on response, False on timeout or if cmd is not ASCII.
+        """
+        cmd = self._encode(cmd)
+        if cmd is None:
+            return False
+        async with self._lock:
+            await self._discard_input()
+            self.writer.write(cmd+b"\r\n")
+            await self.writer.drain()
+            return await self._read_response()
+        
+    async def _read_response(self):
+        """
+        Called internally. Waits for one answer line from the LCD.
+        
+        :returns: True on response, False on timeout.
+        """
+        self.ok = False
+        self.response_body = b""
+        try:
+            line = await asyncio.wait_for(self._lines.get(), self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        if len(line) == 0:
+            return False
+        self.ok = (line == b'OK')
+        self.response_body = line
+        return True
+        
+    def _start_reading(self):
+        """Called internally. Starts reading answers from the current reader."""
+        self._reader_task = asyncio.ensure_future(self._read_lines(self.reader))
+        
+    async def _read_lines(self, reader):
+        """
+        Called internally. Runs as a task, moving every line received
+        into self._lines, until the port is closed.
+        """
+        # answers are read all the time (not only while a command waits
+        # for one), so an answer arriving after its command timed out
+        # can be told apart and discarded by _discard_input()
+        while True:
+            try:
+                line = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError:
+                return
+            except asyncio.LimitOverrunError as e:
+                # far too long to be an answer
+                await reader.readexactly(e.consumed)
+                continue
+            self._lines.put_nowait(line.strip())
+        
+    async def _discard_input(self):
+        """
+        Called internally, before writing a command. Throws away the lines
+        received while no answer was expected: answers to the init flush,
+        or arriving late after a timeout or after TextFont() gave up.
+        """
+        # let _read_lines() pick up what the reader already has
+        await asyncio.sleep(0)
+        while not self._lines.empty():
+            self._lines.get_nowait()
+        
+        
+        
+    # ========================================================================
+    # INTERNAL LCD METHODS
+    # ========================================================================
+    
+    async def Reset(self):
+        """Resets the LCD.
+        
+        :returns: True on success, False otherwise."""
+        return await self.send_serial("RESET")
+        
+    async def Version(self):
+        """Prints version info on the display."""
+        return await self.send_serial("VER")
+        
+    async def Baudrate(self, baudrate):
+        """Changes the baudrate. BE CAREFUL: THIS IS PERMANENT IN FLASH!
+        See SunLCD.Baudrate().
+        
+        :param baudrate: The new baudrate. Both the display and this object will be modified.
+        :returns: True on success, False otherwise. But always fails...
+        """
+        res = await self.send_serial("BPS(%s)" % (baudrate,))
+        async with self._lock:
+            self._reader_task.cancel()
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.reader, self.writer = await serial_asyncio.open_serial_connection(url=self.port, baudrate=baudrate)
+            self._start_reading()
+        return res
+        
+    async def Clear(self, color = 0):
+        """
+        Clears the screen to a specified color.
+        
+        :param color: Screen color (default black).
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial("CLR(%s)" % (color,))
+        
+    async def On(self, on_off):
+        """Turns the LCD ON and OFF.
+        
+        :param on: If False or 0, will turn LCD OFF. Anything else will turn ON.
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._on_cmd(on_off))
         
+    async def RawImage(self, address, position, size, transparent = 0):
+        """
+        Displays an image from the internal memory.
+        
+        :param address: Address from memory (starts at 2097152)
+        :param position: A tuple (X,Y)
         :param size: A tuple (W,H)
-        :returns: The image ID
+        :param transparent: 0 - not transparent. 1 - transparent (transparent color is white)
+        :returns: True on success, False otherwise.
         """
-        byte_len = size[0]*size[1]*2
-        self.img_list.append([self.img_offset,size])
-        self.img_offset += byte_len
-        return len(self.img_list)-1
+        return await self.send_serial(self._raw_image_cmd(address, position, size, transparent))
         
+    async def Orientation(self, orientation):
+        """Sets the orientation. 1 means horizontal, 0 means vertical.
         
-    # 
-    def ListFont(self, char_size, char_list = " !\"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\]^_`abcdefghijklmnopqrstuvwxyz{|}~"):
+        :param orientation: 1 is horizontal, 0 is vertical. 
+        :returns: True on success, False otherwise.
         """
-        Adds information over a list of monospaced character images.
-        They must be present in the flash memory sequentially in the same order.
+        cmd = self._orientation_cmd(orientation)
+        if cmd is None:
+            return False
+        return await self.send_serial(cmd)
         
-        :param char_size: A tuple (W,H)
-        :param char_list: A string containing the chars in the same order as 
-            they appear in the map. Defaults to ASCII char range 0x20 - 0x7E
-        :returns: Font ID
+    async def Brightness(self, level):
+        """Sets the backlight brightness.
+        
+        :param level: Intensity in the range 0.0 - 1.0
+        :returns: True on success, False otherwise.
         """
-        this_font = {}
-        i = 0
-        cl_len = len(char_list)
-        last_i = cl_len-1
-        # create the font map
-        for c in char_list:
-            this_font[c] = self.ListImage(char_size)
-        # add the font to the font list
-        self.font_list.append(this_font)
-        return len(self.font_list)-1
-                
-                
-    def ShowImage(self, image_id, position, transparent=0):
+        cmd = self._brightness_cmd(level)
+        if cmd is None:
+            return False
+        return await self.send_serial(cmd)
+        
+    async def Point(self, location, color = 15):
+        """
+        Prints a point (pixel).
+        
+        :param location: A touple (X,Y)
+        :param color: Point color (default white).
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._point_cmd(location, color))
+        
+    async def Line(self, origin, destination, color = 15):
+        """
+        Prints a line.
+        
+        :param origin: A touple (X,Y)
+        :param destination: A touple (X,Y)
+        :param color: Point color (default white).
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._line_cmd(origin, destination, color))
+        
+    async def HollowBox(self, top_left, bottom_right, color = 15):
+        """
+        Prints a hollow box.
+        
+        :param top_left: A touple (X,Y)
+        :param bottom_right: A touple (X,Y)
+        :param color: Point color (default white).
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._box_cmd("BOX", top_left, bottom_right, color))
+        
+    async def FilledBox(self, top_left, bottom_right, color = 15):
+        """
+        Prints a filled box.
+        
+        :param top_left: A touple (X,Y)
+        :param bottom_right: A touple (X,Y)
+        :param color: Point color (default white).
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._box_cmd("BOXF", top_left, bottom_right, color))
+        
+    async def HollowCircle(self, center, radius, color = 15):
+        """
+        Prints a hollow circle.
+        
+        :param center: A touple (X,Y)
+        :param radius: The radius
+        :param color: Point color (default white).
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._circle_cmd("CIR", center, radius, color))
+        
+    async def FilledCircle(self, center, radius, color = 15):
+        """
+        Prints a filled circle.
+        
+        :param center: A touple (X,Y)
+        :param radius: The radius
+        :param color: Point color (default white).
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._circle_cmd("CIRF", center, radius, color))
+        
+    async def Background(self, color):
+        """Sets background color for text.
+        
+        :param color: Color number (you can use one of the color names instance.COLOR_xxxx)
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial("SBC(%s)" % (color,))
+        
+    async def TextSmall(self, location, text, color = 15):
+        """
+        Prints text with font 16.
+        
+        :param location: A touple (X,Y)
+        :param text: Text to be printed
+        :param color: Text color (default white). Current background color will be used.
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._text_cmd("DCV16", location, text, color))
+        
+    async def TextMedium(self, location, text, color = 15):
+        """
+        Prints text with font 24.
+        
+        :param location: A touple (X,Y)
+        :param text: Text to be printed
+        :param color: Text color (default white). Current background color will be used.
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._text_cmd("DCV24", location, text, color))
+        
+    async def TextLarge(self, location, text, color = 15):
+        """
+        Prints text with font 32.
+        
+        :param location: A touple (X,Y)
+        :param text: Text to be printed
+        :param color: Text color (default white). Current background color will be used.
+        :returns: True on success, False otherwise.
+        """
+        return await self.send_serial(self._text_cmd("DCV32", location, text, color))
+        
+        
+        
+    # ========================================================================
+    # OBJECT-LEVEL METHODS
+    # ========================================================================
+    
+    async def LineTo(self, position, color = 15):
+        """
+        Draws a line from the current internal cursor to the position specified,
+        and moves the cursor to that position.
+        
+        :param position: A tuple (X,Y)
+        :param color: Line color (default white).
+        :returns: True on success, False otherwise.
+        """
+        position = self._to_position(position)
+        if position is None:
+            return False
+        if await self.Line(self.cursor, position, color) is False:
+            return False
+        return self.MoveTo(position)
+        
+    async def ShowImage(self, image_id, position, transparent=0):
         """
         Shows an image from te listed images (ListImage())
         
@@ -415,13 +1280,12 @@ class SunLCD:
         :param position: A tuple (X,Y)
         :returns: True on success, False otherwise.
         """
-        if image_id > (len(self.img_list)-1):
+        cmd = self._show_image_cmd(image_id, position, transparent)
+        if cmd is None:
             return False
-            
-        img_info = self.img_list[image_id]
-        return self.RawImage(img_info[0], position, img_info[1], transparent)
+        return await self.send_serial(cmd)
         
-    def TextFont(self, font_id, position, text, transparent=0):
+    async def TextFont(self, font_id, position, text, transparent=0):
         """
         Prints text using image fonts.
         
@@ -432,62 +1296,34 @@ class SunLCD:
         :param transparent: If 1, text will be rendered transparent.
         :returns: True on success, False otherwise.
         """
-        if font_id > (len(self.font_list)-1):
+        batches = self._text_batches(font_id, position, text, transparent)
+        if batches is None:
             return False
-        this_font = self.font_list[font_id]
-        # this_font[ 'char' ] = Image ID
-        # self.img_list[ Image ID ][1] = (W,H)
-        
-        x = position[0]
-        y = position[1]
-        
-        if self.current_orientation == self.HORIZONTAL:
-            lcd_w = self.standard_height
-            lcd_h = self.standard_width
-        else:
-            lcd_w = self.standard_width
-            lcd_h = self.standard_height
-        
         
-        # we have to flush every 16 chars to avoid buffer overflow in the lcd
-        i = 0 
-        send_str = ""
-        for c in text:
-            if c in this_font:
-                # Prints the char
-                char_img_id = this_font[c]
-                img_info = self.img_list[char_img_id]
-                char_size = img_info[1]
-                # below is deprecated: stack several instructions into one string instead
-                #self.ShowImage(char_img_id, (x,y), transparent) 
-                
-                # FSIMG(addr,x,y,w,h,mode)
-                send_str += "FSIMG("+str(img_info[0])+","+str(x)+","+str(y)+","+str(char_size[0])+","+str(char_size[1])+","+str(transparent)+");"
-
-                
-                # Moves the cursor
-                x += char_size[0]
-                # line wrap?
-                if x >= (lcd_w - char_size[0]):
-                    x = 0
-                    y += char_size[1]
-                    # screen wrap?
-                    if y >= (lcd_h - char_size[1]):
-                        y = 0
-                
-                # if buffered 16 chars, send them and reset counter and buffer
-                i += 1
-                if i >= 16:
-                    res = self.send_serial(send_str)
-                    if res is False:
+        async with self._lock:
+            await self._discard_input()
+            # same pipelining as SunLCD: keep up to max_pending_bytes
+            # waiting for an answer before sending the next batch.
+            # If an answer times out, the ones still to come are
+            # discarded before the next command
+            res = True
+            pending = []
+            pending_bytes = 0
+            for send_str in batches:
+                data = bytes(send_str)+b"\r\n"
+                while len(pending) > 0 and pending_bytes + len(data) > self.max_pending_bytes:
+                    pending_bytes -= pending.pop(0)
+                    if await self._read_response() is False:
                         return False
-                    send_str = ""
-                    i = 0
-            
-        if len(send_str) > 0:
-            res = self.send_serial(send_str)
-            return res
-        else:
+                    res = res and self.ok
+                self.writer.write(data)
+                await self.writer.drain()
+                pending.append(len(data))
+                pending_bytes += len(data)
+            for _ in pending:
+                if await self._read_response() is False:
+                    return False
+                res = res and self.ok
+            self.ok = res
             return True
-
-            
\ No newline at end of file
+        
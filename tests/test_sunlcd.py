@@ -0,0 +1,285 @@
+"""
+Tests for the SunLCD and AsyncSunLCD serial handling and text layout, using a fake serial port.
+
+Run with: python -m unittest discover tests
+"""
+
+import asyncio
+import importlib.util
+import os
+import random
+import sys
+import types
+import unittest
+
+# pyserial is not needed, the port is replaced by FakeSerial below
+sys.modules.setdefault('serial', types.ModuleType('serial'))
+
+_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '__init__.py')
+_spec = importlib.util.spec_from_file_location('jc024_lcd', _path)
+jc024 = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(jc024)
+
+
+class FakeSerial:
+    """Answers OK to every command line, like the LCD does."""
+
+    def __init__(self, port, baudrate=115200, timeout=None):
+        self.rx = b""
+        self.written = []
+        self._partial = b""
+        # when set, the answer to the next command is lost
+        self.drop_next = False
+
+    def write(self, data):
+        assert isinstance(data, (bytes, bytearray))
+        self.written.append(bytes(data))
+        self._partial += bytes(data)
+        while b"\r\n" in self._partial:
+            line, self._partial = self._partial.split(b"\r\n", 1)
+            if len(line) == 0:
+                continue
+            if self.drop_next:
+                self.drop_next = False
+            else:
+                self.rx += b"OK\r\n"
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
+
+    def read(self, n=1):
+        data, self.rx = self.rx[:n], self.rx[n:]
+        return data
+
+    def readline(self):
+        i = self.rx.find(b"\n")
+        if i < 0:
+            # timeout
+            data, self.rx = self.rx, b""
+            return data
+        data, self.rx = self.rx[:i+1], self.rx[i+1:]
+        return data
+
+    def reset_input_buffer(self):
+        self.rx = b""
+
+    def flush(self):
+        pass
+
+
+class FakeWriter:
+    """Answers every command line by feeding the reader, like the LCD does."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.written = []
+        self._partial = b""
+        # answer to the next command, None to lose it
+        self.answers = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        self._partial += bytes(data)
+        while b"\r\n" in self._partial:
+            line, self._partial = self._partial.split(b"\r\n", 1)
+            if len(line) == 0:
+                continue
+            answer = self.answers.pop(0) if self.answers else b"OK"
+            if answer is not None:
+                self.reader.feed_data(answer + b"\r\n")
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def cursor_walk(count, position, char_size, lcd_size):
+    """Where TextFont() should print each char, moving the cursor one char at a time."""
+    x, y = position
+    positions = []
+    for i in range(count):
+        positions.append((x, y))
+        x += char_size[0]
+        if x >= (lcd_size[0] - char_size[0]):
+            x = 0
+            y += char_size[1]
+            if y >= (lcd_size[1] - char_size[1]):
+                y = 0
+    return positions
+
+
+class SunLCDTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._serial = getattr(jc024.serial, 'Serial', None)
+        jc024.serial.Serial = FakeSerial
+        self.lcd = jc024.SunLCD('fake')
+        self.ser = self.lcd.ser
+        del self.ser.written[:]
+
+    def tearDown(self):
+        if self._serial is None:
+            del jc024.serial.Serial
+        else:
+            jc024.serial.Serial = self._serial
+
+
+class TextPositionsTest(SunLCDTestCase):
+
+    def printed_positions(self):
+        cmds = b"".join(self.ser.written).replace(b"\r\n", b"").split(b";")
+        return [tuple(int(v) for v in cmd.split(b",")[1:3]) for cmd in cmds if cmd]
+
+    def test_wraps_like_cursor_walk(self):
+        rnd = random.Random(1234)
+        for _ in range(300):
+            char_size = (rnd.randint(1, 300), rnd.randint(1, 300))
+            position = (rnd.randint(-50, 450), rnd.randint(-50, 450))
+            orientation = rnd.randint(0, 1)
+            count = rnd.randint(0, 300)
+            lcd_size = (320, 240) if orientation else (240, 320)
+            self.lcd.Orientation(orientation)
+            font = self.lcd.ListFont(char_size)
+            del self.ser.written[:]
+            self.assertTrue(self.lcd.TextFont(font, position, "x"*count))
+            self.assertEqual(self.printed_positions(),
+                             cursor_walk(count, position, char_size, lcd_size),
+                             (count, position, char_size, orientation))
+
+    def test_zero_sized_font(self):
+        for char_size in [(0, 16), (8, 0), (0, 0)]:
+            font = self.lcd.ListFont(char_size)
+            del self.ser.written[:]
+            self.assertTrue(self.lcd.TextFont(font, (3, 4), "x"*20))
+            self.assertEqual(self.printed_positions(),
+                             cursor_walk(20, (3, 4), char_size, (240, 320)))
+
+
+class AnswerPairingTest(SunLCDTestCase):
+
+    def test_batch_reads_every_answer(self):
+        font = self.lcd.ListFont((8, 16))
+        with self.lcd.batch():
+            self.assertTrue(self.lcd.Point((1, 1)))
+            self.assertTrue(self.lcd.TextFont(font, (0, 0), "hello"*100))
+            self.assertTrue(self.lcd.Line((0, 0), (5, 5)))
+        self.assertTrue(self.lcd.ok)
+        self.assertEqual(self.lcd._pending_acks, 0)
+        self.assertEqual(self.ser.rx, b"")
+        # never more than one command buffer in flight by default
+        self.assertTrue(all(len(w) <= self.lcd.max_pending_bytes for w in self.ser.written))
+
+    def test_batch_exception_sends_nothing(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.lcd.batch():
+                self.lcd.Point((1, 1))
+                1/0
+        self.assertEqual(self.ser.written, [])
+        self.assertEqual(self.lcd._pending_acks, 0)
+        self.assertTrue(self.lcd.Clear())
+
+    def test_lost_answer_does_not_shift_later_ones(self):
+        font = self.lcd.ListFont((8, 16))
+        self.ser.drop_next = True
+        self.assertFalse(self.lcd.TextFont(font, (0, 0), "hello"*100))
+        # the rest of the answers arrive late
+        self.ser.rx += b"OK\r\n"
+        self.assertTrue(self.lcd.Clear())
+        self.assertTrue(self.lcd.ok)
+        self.assertEqual(self.ser.rx, b"")
+
+    def test_extra_line_is_discarded(self):
+        self.ser.rx += b"ERR\r\n"
+        self.assertTrue(self.lcd.Reset())
+        self.assertTrue(self.lcd.ok)
+        self.assertEqual(self.lcd.response_body, b"OK")
+
+    def test_readback_counts_pending_answers(self):
+        self.lcd.send_serial_async("PS(1,1,1)")
+        self.lcd.send_serial_async("PS(2,2,1)")
+        self.assertTrue(self.lcd.ReadBack())
+        self.assertEqual(self.lcd._pending_acks, 0)
+        self.assertTrue(self.lcd._drain_acks())
+
+    def test_arguments_sent_as_given(self):
+        self.assertTrue(self.lcd.Point(("10", "20")))
+        self.assertTrue(self.lcd.Line((1.5, 2), (3, 4)))
+        self.assertTrue(self.lcd.Clear("2"))
+        self.assertEqual(self.ser.written, [b"PS(10,20,15)\r\n", b"PL(1.5,2,3,4,15)\r\n", b"CLR(2)\r\n"])
+
+    def test_non_ascii_text(self):
+        self.assertFalse(self.lcd.TextSmall((0, 0), "café"))
+        self.assertEqual(self.ser.written, [])
+
+    def test_text_items_that_are_not_chars(self):
+        font = self.lcd.ListFont((8, 16))
+        self.assertTrue(self.lcd.TextFont(font, (0, 0), b"abc"))
+        self.assertEqual(self.ser.written, [])
+        self.assertTrue(self.lcd.TextFont(font, (0, 0), ("a", 1, None)))
+        self.assertEqual(len(self.ser.written), 1)
+        self.assertEqual(self.ser.written[0].count(b"FSIMG"), 1)
+
+
+
+class AsyncAnswerPairingTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.reader = asyncio.StreamReader()
+        self.writer = FakeWriter(self.reader)
+        # the lcd answers the init flush with an error
+        self.reader.feed_data(b"ERR\r\n")
+
+        async def open_serial_connection(url, baudrate):
+            return self.reader, self.writer
+        self._serial_asyncio = jc024.serial_asyncio
+        jc024.serial_asyncio = types.SimpleNamespace(open_serial_connection=open_serial_connection)
+        self.lcd = await jc024.AsyncSunLCD.open('fake', timeout=0.05)
+
+    async def asyncTearDown(self):
+        await self.lcd.close()
+        jc024.serial_asyncio = self._serial_asyncio
+
+    async def test_init_answer_is_discarded(self):
+        self.assertTrue(self.lcd.ok)
+        self.assertTrue(await self.lcd.Reset())
+        self.assertTrue(self.lcd.ok)
+        self.assertEqual(self.lcd.response_body, b"OK")
+
+    async def test_late_answer_is_discarded(self):
+        self.writer.answers = [None]
+        self.assertFalse(await self.lcd.Clear())
+        # the answer to Clear() arrives after the timeout
+        self.reader.feed_data(b"OK\r\n")
+        self.writer.answers = [b"ERR"]
+        self.assertTrue(await self.lcd.Point((1, 1)))
+        self.assertFalse(self.lcd.ok)
+        self.assertEqual(self.lcd.response_body, b"ERR")
+
+    async def test_text_font_reads_every_answer(self):
+        font = self.lcd.ListFont((8, 16))
+        del self.writer.written[:]
+        self.assertTrue(await self.lcd.TextFont(font, (0, 0), "hello"*100))
+        self.assertTrue(self.lcd.ok)
+        self.assertGreater(len(self.writer.written), 1)
+        self.assertTrue(all(len(w) <= self.lcd.max_pending_bytes for w in self.writer.written))
+        self.assertTrue(self.lcd._lines.empty())
+
+    async def test_answers_left_by_text_font_are_discarded(self):
+        font = self.lcd.ListFont((8, 16))
+        self.writer.answers = [None]
+        self.assertFalse(await self.lcd.TextFont(font, (0, 0), "hello"*100))
+        self.reader.feed_data(b"OK\r\n")
+        self.writer.answers = [b"ERR"]
+        self.assertTrue(await self.lcd.Clear())
+        self.assertFalse(self.lcd.ok)
+
+
+if __name__ == '__main__':
+    unittest.main()